@@ -2,5 +2,10 @@
 
 import logging
 
+try:  # libyaml-backed loader is an order of magnitude faster, but it is optional in PyYAML builds
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader  # type: ignore
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(format="{name}: [{levelname}] {message}", style="{")
@@ -12,7 +12,7 @@ from pathlib import Path
 
 import yaml
 
-from keymap_drawer import logger
+from keymap_drawer import SafeLoader, logger
 from keymap_drawer.config import Config, DrawConfig
 from keymap_drawer.draw import KeymapDrawer
 from keymap_drawer.keymap import KeymapData
@@ -21,7 +21,7 @@ from keymap_drawer.parse import QmkJsonParser, ZmkKeymapParser
 
 def draw(args: Namespace, config: Config) -> None:
     """Draw the keymap in SVG format to stdout."""
-    yaml_data = yaml.safe_load(args.keymap_yaml)
+    yaml_data = yaml.load(args.keymap_yaml, Loader=SafeLoader)
     assert "layers" in yaml_data, 'Keymap needs to be specified via the "layers" field in keymap_yaml'
 
     if args.qmk_keyboard or args.qmk_info_json or args.dts_layout or args.ortho_layout or args.cols_thumbs_notation:
@@ -62,7 +62,7 @@ def draw(args: Namespace, config: Config) -> None:
 def parse(args: Namespace, config: Config) -> None:
     """Call the appropriate parser for given args and dump YAML keymap representation to stdout."""
     if args.base_keymap:
-        yaml_data = yaml.safe_load(args.base_keymap)
+        yaml_data = yaml.load(args.base_keymap, Loader=SafeLoader)
         base = KeymapData(layers=yaml_data["layers"], combos=yaml_data.get("combos", []), layout=None, config=None)
     else:
         base = None
@@ -144,7 +144,7 @@ def main() -> None:
         "--ortho-layout",
         help="Parametrized ortholinear layout definition in a YAML format, "
         "for example '{split: false, rows: 4, columns: 12}'",
-        type=yaml.safe_load,
+        type=lambda s: yaml.load(s, Loader=SafeLoader),
     )
     draw_p.add_argument(
         "-n",
@@ -233,7 +233,7 @@ def main() -> None:
     if args.debug:
         logger.setLevel(logging.DEBUG)
 
-    config = Config.parse_obj(yaml.safe_load(args.config)) if args.config else Config()
+    config = Config.parse_obj(yaml.load(args.config, Loader=SafeLoader)) if args.config else Config()
 
     match args.command:
         case "draw":
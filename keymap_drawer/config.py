@@ -493,6 +493,9 @@ class ParseConfig(BaseSettings, env_prefix="KEYMAP_", extra="ignore"):
     # additional zmk include paths to be added to the preprocessor
     zmk_additional_includes: list[str] = []
 
+    # use a local filesystem cache on an OS-specific location for C preprocessor outputs of ZMK keymaps
+    use_local_cache: bool = Field(exclude=True, default=True)
+
 
 class Config(BaseSettings, env_prefix="KEYMAP_"):
     """All configuration settings used for this module."""
@@ -4,7 +4,6 @@ keymap with layers and optionally combo definitions, then can draw an SVG
 representation of the keymap using these two.
 """
 
-from copy import deepcopy
 from html import escape
 from io import StringIO
 from typing import Mapping, Sequence, TextIO
@@ -191,7 +190,7 @@ class KeymapDrawer(ComboDrawerMixin, UtilsMixin):
         ghost_keys: Sequence[int] | None = None,
     ) -> None:
         """Print SVG code representing the keymap."""
-        layers = deepcopy(self.keymap.layers)
+        layers = {name: list(layer) for name, layer in self.keymap.layers.items()}  # keys are copied if modified
         if draw_layers:
             assert all(l in layers for l in draw_layers), "Some layer names selected for drawing are not in the keymap"
             layers = {name: layer for name, layer in layers.items() if name in draw_layers}
@@ -214,7 +213,7 @@ class KeymapDrawer(ComboDrawerMixin, UtilsMixin):
                     0 <= key_position < len(self.layout)
                 ), "Some key positions for `ghost_keys` are negative or too large for the layout"
                 for layer in layers.values():
-                    layer[key_position].type = "ghost"
+                    layer[key_position] = layer[key_position].model_copy(update={"type": "ghost"})
 
         self.layer_names = set(layers)
 
@@ -8,18 +8,29 @@ tree-sitter-devicetree to run queries to find compatible nodes and extract prope
 Node overrides via node references are supported in a limited capacity.
 """
 
+import hashlib
+import json
 import logging
+import os
 import re
+from functools import cache, cached_property
+from importlib.metadata import PackageNotFoundError, version
 from io import StringIO
 from itertools import chain
+from pathlib import Path
+from stat import S_ISREG
 
 import tree_sitter_devicetree as ts
 from pcpp.preprocessor import Action, OutputDirective, Preprocessor  # type: ignore
+from platformdirs import user_cache_dir
 from tree_sitter import Language, Node, Parser, Tree
 
 logger = logging.getLogger(__name__)
 
 TS_LANG = Language(ts.language())
+CACHE_PREPROCESS_PATH = Path(user_cache_dir("keymap-drawer", False)) / "preprocessed"
+CACHE_PREPROCESS_MAX_ENTRIES = 100
+CACHE_PREPROCESS_FORMAT = 1  # bump when the preprocessing pipeline or the cache entry format changes
 
 
 class DTNode:
@@ -28,12 +39,11 @@ class DTNode:
     name: str
     label: str | None
     content: str
-    children: list["DTNode"]
 
-    def __init__(self, node: Node, text_buf: bytes, override_nodes: list["DTNode"] | None = None):
+    def __init__(self, node: Node, text_buf: bytes, override_nodes: dict[str, list["DTNode"]] | None = None):
         """
         Initialize a node from its name (which may be in the form of `label:name`)
-        and `parse` which contains the node itself.
+        and `parse` which contains the node itself. `override_nodes` maps labels to nodes that override them.
         """
         self.node = node
         self.text_buf = text_buf
@@ -41,26 +51,38 @@ class DTNode:
         assert name_node is not None
         self.name = self._get_content(name_node)
         self.label = self._get_content(v) if (v := node.child_by_field_name("label")) is not None else None
-        self.children = sorted(
-            (DTNode(child, text_buf, override_nodes) for child in node.children if child.type == "node"),
-            key=lambda x: x.node.start_byte,
-        )
+        self.override_nodes = override_nodes
         self.overrides = []
         if override_nodes and self.label is not None:
-            # consider pre-compiling nodes by label for performance
-            self.overrides = [node for node in override_nodes if self.label == node.name.lstrip("&")]
+            self.overrides = override_nodes.get(self.label, [])
+
+    @cached_property
+    def children(self) -> list["DTNode"]:
+        """Child nodes in source order, only built for nodes whose children are requested."""
+        return [
+            DTNode(child, self.text_buf, self.override_nodes) for child in self.node.children if child.type == "node"
+        ]
 
     def _get_content(self, node: Node) -> str:
         return self.text_buf[node.start_byte : node.end_byte].decode("utf-8").replace("\n", " ")
 
+    @cached_property
+    def _properties(self) -> list[tuple[str, Node]]:
+        """Property names and nodes of this node followed by its overrides, computed once for all lookups."""
+        out = []
+        for node in chain([self.node], (override_node.node for override_node in self.overrides)):
+            for child in node.children:
+                if child.type != "property":
+                    continue
+                name_node = child.child_by_field_name("name")
+                assert name_node is not None
+                out.append((self._get_content(name_node), child))
+        return out
+
     def _get_property(self, property_re: str) -> list[Node] | None:
-        children = [node for node in self.node.children if node.type == "property"]
-        for override_node in self.overrides:
-            children += [node for node in override_node.node.children if node.type == "property"]
-        for child in children[::-1]:
-            name_node = child.child_by_field_name("name")
-            assert name_node is not None
-            if re.match(property_re, self._get_content(name_node)):
+        property_match = _compile_property_re(property_re).match
+        for name, child in reversed(self._properties):
+            if property_match(name):
                 return child.children_by_field_name("value")
         return None
 
@@ -107,13 +129,14 @@ class DTNode:
         )
 
 
-class DeviceTree:
+class DeviceTree:  # pylint: disable=too-many-instance-attributes
     """
     Class that parses a DTS file (optionally preprocessed by the C preprocessor)
     and provides methods to extract `compatible` and `chosen` nodes as DTNode's.
     """
 
     _custom_data_header = "__keymap_drawer_data__"
+    _has_include_re = re.compile(r"__has_include\([^)\n]*\)")
 
     def __init__(
         self,
@@ -122,6 +145,7 @@ class DeviceTree:
         preprocess: bool = True,
         preamble: str | None = None,
         additional_includes: list[str] | None = None,
+        use_local_cache: bool = False,
     ):
         """
         Given an input DTS string `in_str` and `file_name` it is read from, parse it to be
@@ -129,19 +153,24 @@ class DeviceTree:
         For performance reasons, the whole tree isn't parsed into DTNode's.
 
         If `preamble` is set to a non-empty string, prepend it to the read buffer.
+        If `use_local_cache` is set, preprocessor outputs are cached on the local filesystem.
         """
         self.raw_buffer = in_str
         self.file_name = file_name
         self.additional_includes = additional_includes
+        self.use_local_cache = use_local_cache
+        self._macros: dict | None = None  # macros defined by the input, if it was run through the preprocessor
         if preamble:
             self.raw_buffer = preamble + "\n" + self.raw_buffer
 
-        prepped = self._preprocess(self.raw_buffer, file_name, self.additional_includes) if preprocess else in_str
+        prepped = self._preprocess(self.raw_buffer) if preprocess else in_str
 
         self.ts_buffer = prepped.encode("utf-8")
         tree = Parser(TS_LANG).parse(self.ts_buffer)
         self.root_nodes = self._find_root_ts_nodes(tree)
-        self.override_nodes = [DTNode(node, self.ts_buffer) for node in self._find_override_ts_nodes(tree)]
+        self.override_nodes: dict[str, list[DTNode]] = {}
+        for override_node in (DTNode(node, self.ts_buffer) for node in self._find_override_ts_nodes(tree)):
+            self.override_nodes.setdefault(override_node.name.lstrip("&"), []).append(override_node)
         self.chosen_nodes = [DTNode(node, self.ts_buffer) for node in self._find_chosen_ts_nodes(tree)]
 
     @staticmethod
@@ -198,11 +227,62 @@ class DeviceTree:
             key=lambda node: node.start_byte,
         )
 
-    @staticmethod
-    def _preprocess(in_str: str, file_name: str | None = None, additional_includes: list[str] | None = None) -> str:
+    def _preprocess(self, in_str: str) -> str:
+        """
+        Run the C preprocessor on `in_str`, reusing a previous output from the local cache if enabled.
+        Cached outputs are keyed by the input and include paths, and invalidated when any file probed
+        while resolving includes changes, including ones that did not exist. Outputs with errors are not cached.
+        """
+        cache_path = None
+        if self.use_local_cache:
+            key = "\0".join(
+                [
+                    _get_preprocess_cache_version(),
+                    in_str,
+                    os.getcwd(),
+                    self.file_name or "",
+                    *(self.additional_includes or []),
+                ]
+            )
+            cache_path = CACHE_PREPROCESS_PATH / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+            if (prepped := _read_preprocess_cache(cache_path)) is not None:
+                logger.debug("found preprocessed output in local cache")
+                return prepped
+
         # ignore__has_include(...) in preprocessor ifs because pcpp can't handle them
-        in_str = re.sub(r"__has_include\(.*?\)", "0", in_str)
+        in_str = self._has_include_re.sub("0", in_str)
+
+        preprocessor = self._get_preprocessor()
+        probed: dict[str, int | None] = {}  # include candidate paths to their mtimes, None if they couldn't be opened
+        default_file_open = preprocessor.on_file_open
 
+        def file_open_handler(is_system_include, includepath):  # type: ignore
+            try:
+                f = default_file_open(is_system_include, includepath)
+            except OSError:
+                probed[includepath] = None
+                raise
+            probed[includepath] = _get_file_mtime(includepath)
+            return f
+
+        errors = []
+        default_on_error = preprocessor.on_error
+
+        def on_error_handler(file, line, msg):  # type: ignore
+            errors.append(msg)
+            default_on_error(file, line, msg)
+
+        preprocessor.on_file_open = file_open_handler
+        preprocessor.on_error = on_error_handler
+        prepped = self._run_preprocessor(preprocessor, in_str)
+        self._macros = preprocessor.macros
+
+        # do not cache outputs with errors, so that they are reported again on the next run
+        if cache_path is not None and not errors:
+            _write_preprocess_cache(cache_path, prepped, probed)
+        return prepped
+
+    def _get_preprocessor(self) -> Preprocessor:
         def include_handler(*args):  # type: ignore
             raise OutputDirective(Action.IgnoreAndPassThrough)
 
@@ -214,29 +294,45 @@ class DeviceTree:
         preprocessor.on_include_not_found = include_handler
         preprocessor.on_error = on_error_handler
         preprocessor.assume_encoding = "utf-8"
-        for path in additional_includes or []:
+        for path in self.additional_includes or []:
             preprocessor.add_path(path)
-        preprocessor.parse(in_str, source=file_name)
+        return preprocessor
 
+    def _run_preprocessor(self, preprocessor: Preprocessor, in_str: str) -> str:
+        preprocessor.parse(in_str, source=self.file_name)
         with StringIO() as f_out:
             preprocessor.write(f_out)
-            prepped = f_out.getvalue()
-        return re.sub(r"^\s*#.*?$", "", prepped)
+            return f_out.getvalue()
 
-    def get_compatible_nodes(self, compatible_value: str) -> list[DTNode]:
-        """Return a list of nodes that have the given compatible value."""
+    @cached_property
+    def _compatible_ts_nodes(self) -> dict[str, list[Node]]:
+        """
+        Map each (quoted) `compatible` value to the nodes under root nodes that have it, so that all compatible
+        nodes are found with a single query pass over the tree.
+        """
         query = TS_LANG.query(
-            rf"""
+            """
             (node
               (property name: (identifier) @prop value: (string_literal) @propval)
-              (#eq? @prop "compatible") (#eq? @propval "\"{compatible_value}\"")
+              (#eq? @prop "compatible")
             ) @node
             """
         )
-        nodes = chain.from_iterable(query.captures(node).get("node", []) for node in self.root_nodes)
-        return sorted(
-            (DTNode(node, self.ts_buffer, self.override_nodes) for node in nodes), key=lambda x: x.node.start_byte
-        )
+        out: dict[str, dict[int, Node]] = {}
+        for root_node in self.root_nodes:
+            for _, captures in query.matches(root_node):
+                propval = captures["propval"][0]
+                value = self.ts_buffer[propval.start_byte : propval.end_byte].decode("utf-8")
+                for node in captures["node"]:
+                    out.setdefault(value, {})[node.id] = node
+        return {value: sorted(nodes.values(), key=lambda node: node.start_byte) for value, nodes in out.items()}
+
+    def get_compatible_nodes(self, compatible_value: str) -> list[DTNode]:
+        """Return a list of nodes that have the given compatible value."""
+        return [
+            DTNode(node, self.ts_buffer, self.override_nodes)
+            for node in self._compatible_ts_nodes.get(f'"{compatible_value}"', [])
+        ]
 
     def get_chosen_property(self, property_name: str) -> str | None:
         """Return phandle for a given property in the /chosen node."""
@@ -249,17 +345,79 @@ class DeviceTree:
     def preprocess_extra_data(self, data: str) -> str:
         """
         Given a string containing data, preprocess it in the same context as the
-        original input buffer by appending the data to it and extracting the result
-        afterwards.
-
-        TODO(perf): Figure out a good interface to achieve this without running preprocessing
-        twice.
+        original input buffer. If the input buffer was preprocessed in this instance, this reuses
+        the macros it defined, otherwise the data is appended to the input buffer and the result
+        is extracted after preprocessing it again.
         """
+        if self._macros is not None:
+            preprocessor = self._get_preprocessor()
+            preprocessor.macros = self._macros.copy()
+            return self._run_preprocessor(preprocessor, data)
+
         in_str = self.raw_buffer + f"\n{self._custom_data_header}\n{data}"
-        out = self._preprocess(in_str, self.file_name, self.additional_includes)
+        out = self._preprocess(in_str)
         data_pos = out.rfind(f"\n{self._custom_data_header}\n")
         assert data_pos >= 0, (
             f"Preprocessing extra data failed, please make sure '{self._custom_data_header}' "
             "does not get modified by #define's"
         )
         return out[data_pos + len(self._custom_data_header) + 2 :]
+
+
+@cache
+def _compile_property_re(property_re: str) -> re.Pattern:
+    """Compile a property name regex once, since the same few are used for lookups on every node."""
+    return re.compile(property_re)
+
+
+@cache
+def _get_preprocess_cache_version() -> str:
+    """Identify the code producing preprocessed outputs, so that cached outputs are not reused across upgrades."""
+    versions = [str(CACHE_PREPROCESS_FORMAT)]
+    for package in ("keymap-drawer", "pcpp"):
+        try:
+            versions.append(version(package))
+        except PackageNotFoundError:
+            versions.append("unknown")
+    return " ".join(versions)
+
+
+def _get_file_mtime(path: str) -> int | None:
+    """Return the modification time of the file at `path`, or None if it is not an existing file."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_mtime_ns if S_ISREG(stat_result.st_mode) else None
+
+
+def _read_preprocess_cache(cache_path: Path) -> str | None:
+    """
+    Return the cached preprocessor output at `cache_path`, if it exists and none of the files probed for includes
+    changed, appeared or disappeared.
+    """
+    try:
+        with open(cache_path, "rb") as f:
+            cached = json.load(f)
+        if any(_get_file_mtime(path) != mtime for path, mtime in cached["probed"].items()):
+            return None
+        os.utime(cache_path)  # mark as recently used, so that it is pruned last
+        return cached["output"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _write_preprocess_cache(cache_path: Path, prepped: str, probed: dict[str, int | None]) -> None:
+    """
+    Write preprocessor output to `cache_path`, along with modification times of the files probed for includes.
+    Then prune the least recently used entries beyond CACHE_PREPROCESS_MAX_ENTRIES.
+    """
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f_out:
+            json.dump({"probed": probed, "output": prepped}, f_out)
+        entries = sorted(cache_path.parent.glob("*.json"), key=lambda path: path.stat().st_mtime_ns, reverse=True)
+        for path in entries[CACHE_PREPROCESS_MAX_ENTRIES:]:
+            path.unlink(missing_ok=True)
+    except OSError as exc:
+        logger.debug("could not write preprocessed output to local cache: %s", exc)
@@ -44,6 +44,9 @@ class KeymapParser(ABC):  # pylint: disable=too-many-instance-attributes
         self.conditional_layers: dict[int, list[int]] = {}  # then-layer to if-layers mapping
         self.trans_key = LayoutKey.from_key_spec(self.cfg.trans_legend)
         self.raw_binding_map = self.cfg.raw_binding_map.copy()
+        # parsed keys and the layers they activate, per unique binding and `no_shifted` flag
+        self._key_cache: dict[tuple[str, bool], tuple[LayoutKey, list[int]]] = {}
+        self._keycode_map_keys: dict[str, LayoutKey] = {}  # keys built from the parser's keycode map, per keycode
         self._modifier_fn_re = re.compile(
             "(" + "|".join(re.escape(mod) for mod in self._modifier_fn_to_std) + r") *\( *(.*) *\)"
         )
@@ -88,6 +91,15 @@ class KeymapParser(ABC):  # pylint: disable=too-many-instance-attributes
                 fns_str = self.cfg.modifier_fn_map.mod_combiner.format(mod_1=fns_str, mod_2=fn_map[mod])
         return self.cfg.modifier_fn_map.keycode_combiner.format(mods=fns_str, key=key_str)
 
+    def _map_keycode(self, keycode: str, key_spec: str | dict, copy: bool = False) -> LayoutKey:
+        """
+        Return the key for `keycode` given its `key_spec` from this parser's keycode map, building it only once
+        per keycode. Returned keys are shared unless `copy` is set, so they should not be modified in place otherwise.
+        """
+        if (key := self._keycode_map_keys.get(keycode)) is None:
+            key = self._keycode_map_keys[keycode] = LayoutKey.from_key_spec(key_spec)
+        return key.model_copy() if copy else key
+
     def update_layer_names(self, names: list[str]) -> None:
         """Update layer names to given list, then update legends."""
         assert self.layer_names is None  # make sure they weren't preset
@@ -128,22 +140,18 @@ class KeymapParser(ABC):  # pylint: disable=too-many-instance-attributes
 
         # ignore if we already have a way to get to this layer (unless mark_alternate_layer_activators is set)
         is_alternate = False
-        if to_layer in self.layer_activated_from:
+        if (activated_from := self.layer_activated_from.get(to_layer)) is not None:
             if self.cfg.mark_alternate_layer_activators:
                 is_alternate = True
             else:
                 return
         else:
-            self.layer_activated_from[to_layer] = set()
-        self.layer_activated_from[to_layer] |= {
-            (k, is_alternate) for k in key_positions
-        }  # came here through these key(s)
+            activated_from = self.layer_activated_from[to_layer] = set()
+        activated_from.update((k, is_alternate) for k in key_positions)  # came here through these key(s)
 
         # also consider how the layer we are coming from got activated
         for from_layer in from_layers:
-            self.layer_activated_from[to_layer] |= {
-                (k, is_alternate) for k, _ in self.layer_activated_from.get(from_layer, set())
-            }
+            activated_from.update((k, is_alternate) for k, _ in self.layer_activated_from.get(from_layer, ()))
 
     def add_held_keys(self, layers: dict[str, list[LayoutKey]]) -> dict[str, list[LayoutKey]]:
         """Add "held" specifiers to keys that we previously determined were held to activate a given layer."""
@@ -163,10 +171,10 @@ class KeymapParser(ABC):  # pylint: disable=too-many-instance-attributes
                     continue
 
                 key_type = "held alternate" if is_alternate else "held"
-                if key == self.trans_key:  # clear legend if it is a transparent key
+                if key is self.trans_key or key == self.trans_key:  # clear legend if it is a transparent key
                     layers[self.layer_names[layer_index]][key_idx] = LayoutKey(type=key_type)
-                else:
-                    key.type = key_type
+                else:  # keys can be shared between positions, so copy instead of modifying in place
+                    layers[self.layer_names[layer_index]][key_idx] = key.model_copy(update={"type": key_type})
 
         return layers
 
@@ -177,6 +185,35 @@ class KeymapParser(ABC):  # pylint: disable=too-many-instance-attributes
         )  # should all be equal, but that's validated later
         return layers | {name: [LayoutKey() for _ in range(layer_length)] for name in self.virtual_layers}
 
+    def _str_to_key(
+        self, binding: str, current_layer: int | None, key_positions: Sequence[int], no_shifted: bool = False
+    ) -> LayoutKey:
+        """
+        Convert a binding to a LayoutKey, memoizing the parse per unique binding since keymaps contain many
+        repeats. Layers activated by the binding are replayed for the given `current_layer` and `key_positions`
+        on every call, so that held keys are tracked correctly. Returned keys are shared between all occurrences
+        of a binding, so they should not be modified in place.
+        """
+        if (cached := self._key_cache.get((binding, no_shifted))) is None:
+            to_layers: list[int] = []
+            cached = self._key_cache[(binding, no_shifted)] = (
+                self._parse_binding(binding, to_layers, no_shifted),
+                to_layers,
+            )
+        key, to_layers = cached
+        for to_layer in to_layers:
+            self.update_layer_activated_from(
+                [current_layer] if current_layer is not None else [], to_layer, key_positions
+            )
+        return key
+
+    def _parse_binding(self, binding: str, to_layers: list[int], no_shifted: bool = False) -> LayoutKey:
+        """
+        Parse a binding string into a LayoutKey, appending the indices of layers it momentarily activates
+        to `to_layers`. If `no_shifted` is set, do not populate the shifted field.
+        """
+        raise NotImplementedError
+
     def _parse(self, in_str: str, file_name: str | None = None) -> tuple[dict, KeymapData]:
         raise NotImplementedError
 
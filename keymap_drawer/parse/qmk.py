@@ -2,7 +2,6 @@
 
 import json
 import re
-from typing import Sequence
 
 from keymap_drawer.config import ParseConfig
 from keymap_drawer.keymap import KeymapData, LayoutKey
@@ -12,15 +11,18 @@ from keymap_drawer.parse.parse import KeymapParser, ParseError
 class QmkJsonParser(KeymapParser):
     """Parser for json-format QMK keymaps, like Configurator exports or `qmk c2json` outputs."""
 
-    _trans_re = re.compile(r"KC_TRANSPARENT|KC_TRNS|_______")
-    _mo_re = re.compile(r"MO\((\d+)\)")
-    _tog_re = re.compile(r"(TG|TO|DF)\((\d+)\)")
-    _mts_re = re.compile(r"([A-Z_]+)_T\((\S+)\)")
-    _mtl_re = re.compile(r"MT\((\S+),(\S+)\)")
-    _lt_re = re.compile(r"LT\((\d+),(\S+)\)")
-    _osm_re = re.compile(r"OSM\(MOD_(\S+)\)")
-    _osl_re = re.compile(r"OSL\((\d+)\)")
-    _tt_re = re.compile(r"TT\((\d+)\)")
+    _trans_keycodes = frozenset(("KC_TRANSPARENT", "KC_TRNS", "_______"))
+    # all supported keycode functions as a single alternation, tried in order, with outer groups naming each case
+    _keycode_re = re.compile(
+        r"(?P<mo>MO\((?P<mo_layer>\d+)\))"
+        r"|(?P<tog>(?:TG|TO|DF)\((?P<tog_layer>\d+)\))"
+        r"|(?P<mts>(?P<mts_mod>[A-Z_]+)_T\((?P<mts_key>\S+)\))"
+        r"|(?P<mtl>MT\((?P<mtl_mod>\S+),(?P<mtl_key>\S+)\))"
+        r"|(?P<lt>LT\((?P<lt_layer>\d+),(?P<lt_key>\S+)\))"
+        r"|(?P<osm>OSM\(MOD_(?P<osm_mod>\S+)\))"
+        r"|(?P<osl>OSL\((?P<osl_layer>\d+)\))"
+        r"|(?P<tt>TT\((?P<tt_layer>\d+)\))"
+    )
 
     _modifier_fn_to_std = {
         "LCTL": ["left_ctrl"],
@@ -74,60 +76,66 @@ class QmkJsonParser(KeymapParser):
         else:
             self._prefix_re = None
 
-    def _str_to_key(  # pylint: disable=too-many-return-statements
-        self, key_str: str, current_layer: int, key_positions: Sequence[int]
+    def _parse_binding(  # pylint: disable=too-many-return-statements
+        self, binding: str, to_layers: list[int], no_shifted: bool = False
     ) -> LayoutKey:
-        if key_str in self.raw_binding_map:
-            return LayoutKey.from_key_spec(self.raw_binding_map[key_str])
+        if (raw_spec := self.raw_binding_map.get(binding)) is not None:
+            return LayoutKey.from_key_spec(raw_spec)
         if self.cfg.skip_binding_parsing:
-            return LayoutKey(tap=key_str)
+            return LayoutKey(tap=binding)
 
         assert self.layer_names is not None
         assert self.layer_legends is not None
 
         def mapped(key: str) -> LayoutKey:
             if entry := self.cfg.qmk_keycode_map.get(key):
-                return LayoutKey.from_key_spec(entry)
+                return self._map_keycode(key, entry)
             key, mods = self.parse_modifier_fns(key)
             if self._prefix_re is not None:
                 key = self._prefix_re.sub("", key)
-            mapped = LayoutKey.from_key_spec(self.cfg.qmk_keycode_map.get(key, key.replace("_", " ")))
+            if (entry := self.cfg.qmk_keycode_map.get(key)) is None:
+                mapped = LayoutKey(tap=key.replace("_", " "))
+            else:
+                mapped = self._map_keycode(key, entry, copy=bool(mods))
             if mods:
                 mapped.apply_formatter(lambda key: self.format_modified_keys(key, mods))
             return mapped
 
-        key_str = key_str.replace(" ", "")
-        if m := self._trans_re.fullmatch(key_str):  # transparent
-            return self.trans_key
-        if m := self._mo_re.fullmatch(key_str):  # momentary layer
-            to_layer = int(m.group(1).strip())
-            self.update_layer_activated_from([current_layer], to_layer, key_positions)
-            return LayoutKey(tap=self.layer_legends[to_layer])
-        if m := self._tog_re.fullmatch(key_str):  # toggled layer
-            to_layer = int(m.group(2).strip())
-            return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.toggle_label)
-        if m := self._mts_re.fullmatch(key_str):  # short mod-tap syntax
-            tap_key = mapped(m.group(2).strip())
-            return LayoutKey(tap=tap_key.tap, hold=m.group(1), shifted=tap_key.shifted)
-        if m := self._mtl_re.fullmatch(key_str):  # long mod-tap syntax
-            tap_key = mapped(m.group(2).strip())
-            return LayoutKey(tap=tap_key.tap, hold=m.group(1).strip(), shifted=tap_key.shifted)
-        if m := self._lt_re.fullmatch(key_str):  # layer-tap
-            to_layer = int(m.group(1).strip())
-            self.update_layer_activated_from([current_layer], to_layer, key_positions)
-            tap_key = mapped(m.group(2).strip())
-            return LayoutKey(tap=tap_key.tap, hold=self.layer_legends[to_layer], shifted=tap_key.shifted)
-        if m := self._osm_re.fullmatch(key_str):  # one-shot mod
-            tap_key = mapped(m.group(1).strip())
-            return LayoutKey(tap=tap_key.tap, hold=self.cfg.sticky_label, shifted=tap_key.shifted)
-        if m := self._osl_re.fullmatch(key_str):  # one-shot layer
-            to_layer = int(m.group(1).strip())
-            self.update_layer_activated_from([current_layer], to_layer, key_positions)
-            return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.sticky_label)
-        if m := self._tt_re.fullmatch(key_str):  # tap-toggle layer
-            to_layer = int(m.group(1).strip())
-            self.update_layer_activated_from([current_layer], to_layer, key_positions)
-            return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.tap_toggle_label)
+        key_str = binding.replace(" ", "")
+        if "(" not in key_str:  # plain keycode, no need to try keycode functions
+            return self.trans_key if key_str in self._trans_keycodes else mapped(key_str)
+        if not (m := self._keycode_re.fullmatch(key_str)):
+            return mapped(key_str)
+        match m.lastgroup:
+            case "mo":  # momentary layer
+                to_layer = int(m["mo_layer"])
+                to_layers.append(to_layer)
+                return LayoutKey(tap=self.layer_legends[to_layer])
+            case "tog":  # toggled layer
+                to_layer = int(m["tog_layer"])
+                return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.toggle_label)
+            case "mts":  # short mod-tap syntax
+                tap_key = mapped(m["mts_key"])
+                return LayoutKey(tap=tap_key.tap, hold=m["mts_mod"], shifted=tap_key.shifted)
+            case "mtl":  # long mod-tap syntax
+                tap_key = mapped(m["mtl_key"])
+                return LayoutKey(tap=tap_key.tap, hold=m["mtl_mod"], shifted=tap_key.shifted)
+            case "lt":  # layer-tap
+                to_layer = int(m["lt_layer"])
+                to_layers.append(to_layer)
+                tap_key = mapped(m["lt_key"])
+                return LayoutKey(tap=tap_key.tap, hold=self.layer_legends[to_layer], shifted=tap_key.shifted)
+            case "osm":  # one-shot mod
+                tap_key = mapped(m["osm_mod"])
+                return LayoutKey(tap=tap_key.tap, hold=self.cfg.sticky_label, shifted=tap_key.shifted)
+            case "osl":  # one-shot layer
+                to_layer = int(m["osl_layer"])
+                to_layers.append(to_layer)
+                return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.sticky_label)
+            case "tt":  # tap-toggle layer
+                to_layer = int(m["tt_layer"])
+                to_layers.append(to_layer)
+                return LayoutKey(tap=self.layer_legends[to_layer], hold=self.cfg.tap_toggle_label)
         return mapped(key_str)
 
     def _parse(self, in_str: str, file_name: str | None = None) -> tuple[dict, KeymapData]:
@@ -161,7 +169,7 @@ class QmkJsonParser(KeymapParser):
             layers[layer_name] = []
             for ind, key in enumerate(layer):
                 try:
-                    layers[layer_name].append(self._str_to_key(key, layer_ind, [ind]))
+                    layers[layer_name].append(self._str_to_key(key, layer_ind, (ind,)))
                 except Exception as err:
                     raise ParseError(
                         f'Could not parse keycode "{key}" in layer "{layer_name}" with exception "{err}"'
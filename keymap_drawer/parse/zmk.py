@@ -5,10 +5,10 @@ import re
 from functools import cache
 from itertools import chain
 from pathlib import Path
-from typing import Sequence
 
 import yaml
 
+from keymap_drawer import SafeLoader
 from keymap_drawer.config import ParseConfig
 from keymap_drawer.dts import DeviceTree
 from keymap_drawer.keymap import ComboSpec, KeymapData, LayoutKey
@@ -23,7 +23,23 @@ ZMK_DEFINES_PATH = Path(__file__).parent.parent.parent / "resources" / "zmk_defi
 class ZmkKeymapParser(KeymapParser):
     """Parser for ZMK devicetree keymaps, using C preprocessor and tree-sitter-devicetree."""
 
-    _numbers_re = re.compile(r"N(UM(BER)?_)?(\d)")
+    # single-pass display name cleanup: strip C_/K_ prefixes, N1/NUM_1/NUMBER_1 to 1, BT_SEL to BT, _ to space
+    _keyname_re = re.compile(r"^(?:C_K_|C_|K_)|N(?:UM(?:BER)?_)?(\d)|BT_SEL|_")
+    _keyname_subs = {"BT_SEL": "BT", "_": " "}
+    # kinds of built-in behaviors by reference, user-defined behavior kinds are added in `_update_behavior_kinds`
+    _builtin_behavior_kinds = {
+        "&none": "none",
+        "&trans": "trans",
+        "&kp": "key_press",
+        "&kt": "key_toggle",
+        "&bt": "bluetooth",
+        "&out": "raw_params",
+        "&ext_power": "raw_params",
+        "&rgb_ug": "raw_params",
+        "&mo": "momentary_layer",
+        "&to": "toggle_layer",
+        "&tog": "toggle_layer",
+    }
     _modifier_fn_to_std = {
         "LC": ["left_ctrl"],
         "LS": ["left_shift"],
@@ -47,97 +63,103 @@ class ZmkKeymapParser(KeymapParser):
         self.hold_taps = {"&mt": ["&kp", "&kp"], "&lt": ["&mo", "&kp"]}
         self.mod_morphs = {"&gresc": ["&kp ESC", "&kp GRAVE"]}
         self.sticky_keys = {"&sk": ["&kp"], "&sl": ["&mo"]}
+        self._update_behavior_kinds()
         self._prefix_re: re.Pattern | None
         if prefixes := self.cfg.zmk_remove_keycode_prefix:
             self._prefix_re = re.compile(r"\b(" + "|".join(re.escape(prefix) for prefix in set(prefixes)) + ")")
         else:
             self._prefix_re = None
 
+    @classmethod
+    def _keyname_repl(cls, m: re.Match) -> str:
+        if (digit := m.group(1)) is not None:
+            return digit
+        return cls._keyname_subs.get(m.group(0), "")
+
+    def _update_behavior_kinds(self) -> None:
+        """Build the look-up from behavior references to their kinds, used to dispatch binding parsing."""
+        self._behavior_kinds = (
+            {ref: "hold_tap" for ref in self.hold_taps}
+            | {ref: "sticky_key" for ref in self.sticky_keys}
+            | {ref: "mod_morph" for ref in self.mod_morphs}
+            | self._builtin_behavior_kinds
+        )
+
     def _update_raw_binding_map(self, dts: DeviceTree) -> None:
         raw_keys = list(self.raw_binding_map.keys())
         prep_keys = dts.preprocess_extra_data("\n".join(raw_keys)).splitlines()
         assert len(raw_keys) == len(
             prep_keys
         ), "Keys in parse_config.raw_binding_map did not preprocess properly, please check for issues"
-        for old, new in zip(raw_keys, prep_keys):
-            if new != old:
-                self.raw_binding_map[new] = self.raw_binding_map[old]
-                del self.raw_binding_map[old]
+        self.raw_binding_map = {new: self.raw_binding_map[old] for old, new in zip(raw_keys, prep_keys)}
         logger.debug("updated raw_binding_map: %s", self.raw_binding_map)
 
-    def _str_to_key(  # pylint: disable=too-many-return-statements,too-many-locals
-        self, binding: str, current_layer: int | None, key_positions: Sequence[int], no_shifted: bool = False
+    def _parse_binding(  # pylint: disable=too-many-return-statements,too-many-locals
+        self, binding: str, to_layers: list[int], no_shifted: bool = False
     ) -> LayoutKey:
-        if binding in self.raw_binding_map:
-            return LayoutKey.from_key_spec(self.raw_binding_map[binding])
+        if (raw_spec := self.raw_binding_map.get(binding)) is not None:
+            return LayoutKey.from_key_spec(raw_spec)
         binding_parts = binding.split()
-        if binding_parts[0] in self.raw_binding_map:
-            return LayoutKey.from_key_spec(self.raw_binding_map[binding_parts[0]])
+        if (raw_spec := self.raw_binding_map.get(binding_parts[0])) is not None:
+            return LayoutKey.from_key_spec(raw_spec)
         if self.cfg.skip_binding_parsing:
             return LayoutKey(tap=binding)
 
-        assert self.layer_names is not None
-        assert self.layer_legends is not None
-
         def mapped(key: str) -> LayoutKey:
             if entry := self.cfg.zmk_keycode_map.get(key):
-                return LayoutKey.from_key_spec(entry)
+                return self._map_keycode(key, entry)
             key, mods = self.parse_modifier_fns(key)
             if self._prefix_re is not None:
                 key = self._prefix_re.sub("", key)
-            mapped = LayoutKey.from_key_spec(
-                self.cfg.zmk_keycode_map.get(
-                    key,
-                    self._numbers_re.sub(r"\3", key)
-                    .removeprefix("C_")
-                    .removeprefix("K_")
-                    .replace("BT_SEL", "BT")
-                    .replace("_", " "),
-                )
-            )
+            if (entry := self.cfg.zmk_keycode_map.get(key)) is None:
+                mapped = LayoutKey(tap=self._keyname_re.sub(self._keyname_repl, key))
+            else:
+                mapped = self._map_keycode(key, entry, copy=no_shifted or bool(mods))
             if no_shifted:
                 mapped.shifted = ""
             if mods:
                 mapped.apply_formatter(lambda key: self.format_modified_keys(key, mods))
             return mapped
 
-        match binding_parts:
-            case ["&none", *_]:
+        assert self.layer_names is not None
+        assert self.layer_legends is not None
+
+        behavior, *pars = binding_parts
+        match self._behavior_kinds.get(behavior), pars:
+            case "none", _:
                 return LayoutKey()
-            case ["&trans"]:
+            case "trans", []:
                 return self.trans_key
-            case [ref, *_] if ref in self.mod_morphs:
-                tap_key = self._str_to_key(self.mod_morphs[ref][0], current_layer, key_positions)
-                shifted_key = self._str_to_key(self.mod_morphs[ref][1], current_layer, key_positions)
+            case "mod_morph", _:
+                tap_key = self._parse_binding(self.mod_morphs[behavior][0], to_layers)
+                shifted_key = self._parse_binding(self.mod_morphs[behavior][1], to_layers)
                 return LayoutKey(tap=tap_key.tap, hold=tap_key.hold, shifted=shifted_key.tap)
-            case ["&kp", *pars]:
+            case "key_press", _:
                 return mapped(" ".join(pars))
-            case ["&kt", *pars]:
+            case "key_toggle", _:
                 l_key = mapped(" ".join(pars))
                 return LayoutKey(tap=l_key.tap, hold=self.cfg.toggle_label, shifted=l_key.shifted)
-            case [ref, *pars] if ref in self.sticky_keys:
-                l_key = self._str_to_key(f"{self.sticky_keys[ref][0]} {' '.join(pars)}", current_layer, key_positions)
+            case "sticky_key", _:
+                l_key = self._parse_binding(f"{self.sticky_keys[behavior][0]} {' '.join(pars)}", to_layers)
                 return LayoutKey(tap=l_key.tap, hold=self.cfg.sticky_label, shifted=l_key.shifted)
-            case ["&bt", *pars]:
+            case "bluetooth", _:
                 mapped_action = mapped(pars[0])
                 if len(pars) == 1:
                     return mapped_action
                 return LayoutKey(tap=mapped_action.tap, shifted=mapped_action.shifted, hold=pars[1])
-            case [("&out" | "&ext_power" | "&rgb_ug"), *pars]:
+            case "raw_params", _:
                 return LayoutKey(tap=" ".join(pars).replace("_", " "))
-            case [("&mo" | "&to" | "&tog") as behavior, par]:
-                if behavior in ("&mo",):
-                    self.update_layer_activated_from(
-                        [current_layer] if current_layer is not None else [], int(par), key_positions
-                    )
-                    return LayoutKey(tap=self.layer_legends[int(par)])
+            case "momentary_layer", [par]:
+                to_layers.append(to_layer := int(par))
+                return LayoutKey(tap=self.layer_legends[to_layer])
+            case "toggle_layer", [par]:
                 return LayoutKey(tap=self.layer_legends[int(par)], hold=self.cfg.toggle_label)
-            case [ref, hold_par, tap_par] if ref in self.hold_taps:
-                hold_key = self._str_to_key(f"{self.hold_taps[ref][0]} {hold_par}", current_layer, key_positions)
-                tap_key = self._str_to_key(f"{self.hold_taps[ref][1]} {tap_par}", current_layer, key_positions)
+            case "hold_tap", [hold_par, tap_par]:
+                hold_key = self._parse_binding(f"{self.hold_taps[behavior][0]} {hold_par}", to_layers)
+                tap_key = self._parse_binding(f"{self.hold_taps[behavior][1]} {tap_par}", to_layers)
                 return LayoutKey(tap=tap_key.tap, hold=hold_key.tap, shifted=tap_key.shifted)
-            case [ref] | [ref, "0"]:
-                return LayoutKey(tap=ref)
+            case _, ([] | ["0"]):
+                return LayoutKey(tap=behavior)
         return LayoutKey(tap=binding)
 
     def _update_behaviors(self, dts: DeviceTree) -> None:
@@ -159,6 +181,7 @@ class ZmkKeymapParser(KeymapParser):
         logger.debug("found mod-morph bindings: %s", self.mod_morphs)
         self.sticky_keys |= get_behavior_bindings("zmk,behavior-sticky-key", 1)
         logger.debug("found sticky keys bindings: %s", self.sticky_keys)
+        self._update_behavior_kinds()
 
     def _update_conditional_layers(self, dts: DeviceTree) -> None:
         cl_parents = dts.get_compatible_nodes("zmk,conditional-layers")
@@ -202,7 +225,7 @@ class ZmkKeymapParser(KeymapParser):
                 layers[layer_name] = []
                 for ind, binding in enumerate(bindings):
                     try:
-                        layers[layer_name].append(self._str_to_key(binding, layer_ind, [ind]))
+                        layers[layer_name].append(self._str_to_key(binding, layer_ind, (ind,)))
                     except Exception as err:
                         raise ParseError(
                             f'Could not parse binding "{binding}" in layer "{layer_name}" with exception "{err}"'
@@ -256,7 +279,9 @@ class ZmkKeymapParser(KeymapParser):
                 combo["l"] = parse_layers(layers, node.name)
 
             # see if combo had additional properties specified in the config, if so merge them in
-            combos.append(ComboSpec(**(combo | ComboSpec.normalize_fields(self.cfg.zmk_combos.get(node.name, {})))))
+            if node.name in self.cfg.zmk_combos:
+                combo |= ComboSpec.normalize_fields(self.cfg.zmk_combos[node.name])
+            combos.append(ComboSpec(**combo))
         return combos
 
     def _get_physical_layout(self, file_name: str | None, dts: DeviceTree) -> dict:
@@ -292,6 +317,7 @@ class ZmkKeymapParser(KeymapParser):
             self.cfg.preprocess,
             preamble=self.cfg.zmk_preamble + "\n" + _get_zmk_defines(),
             additional_includes=self.cfg.zmk_additional_includes,
+            use_local_cache=self.cfg.use_local_cache,
         )
 
         if self.cfg.preprocess and self.raw_binding_map:
@@ -318,4 +344,4 @@ def _get_zmk_defines() -> str:
 @cache
 def _get_zmk_layouts() -> dict:
     with open(ZMK_LAYOUTS_PATH, "rb") as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=SafeLoader)
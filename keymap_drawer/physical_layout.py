@@ -20,6 +20,7 @@ import yaml
 from platformdirs import user_cache_dir
 from pydantic import BaseModel, Field, field_validator, model_validator
 
+from keymap_drawer import SafeLoader
 from keymap_drawer.config import Config, ParseConfig
 from keymap_drawer.dts import DeviceTree
 
@@ -469,13 +470,14 @@ class QmkLayout(BaseModel):
         ).normalize()
 
 
-def _map_qmk_keyboard(qmk_keyboard: str) -> str:
-    @cache
-    def get_qmk_mappings() -> dict[str, str]:
-        with open(QMK_MAPPINGS_PATH, "rb") as f:
-            return yaml.safe_load(f)
+@cache
+def _get_qmk_mappings() -> dict[str, str]:
+    with open(QMK_MAPPINGS_PATH, "rb") as f:
+        return yaml.load(f, Loader=SafeLoader)
+
 
-    mappings = get_qmk_mappings()
+def _map_qmk_keyboard(qmk_keyboard: str) -> str:
+    mappings = _get_qmk_mappings()
     if to_keyboard := mappings.get(qmk_keyboard):
         return to_keyboard
 
@@ -564,6 +566,7 @@ def _parse_dts_layout(dts_in: Path | BytesIO | bytes, cfg: ParseConfig) -> QmkLa
         preprocess=cfg.preprocess,
         preamble=cfg.zmk_preamble,
         additional_includes=cfg.zmk_additional_includes,
+        use_local_cache=cfg.use_local_cache,
     )
 
     def parse_binding_params(bindings):